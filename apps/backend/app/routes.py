@@ -4,18 +4,29 @@ import openai
 
 router = APIRouter()
 
+# Created on first use so a missing key is reported per request, not at import
+_client: openai.AsyncOpenAI | None = None
+
+def get_client() -> openai.AsyncOpenAI | None:
+    global _client
+    if _client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if api_key:
+            _client = openai.AsyncOpenAI(api_key=api_key)
+    return _client
+
 @router.get("/ask")
-def ask_question(q: str):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+async def ask_question(q: str):
+    client = get_client()
 
-    if not openai.api_key:
+    if client is None:
         return {"error": "Missing OPENAI_API_KEY"}
 
     try:
-        response = openai.ChatCompletion.create(
+        response = await client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": q}],
         )
-        return {"response": response.choices[0].message["content"]}
+        return {"response": response.choices[0].message.content}
     except Exception as e:
         return {"error": str(e)}
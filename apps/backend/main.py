@@ -1,16 +1,114 @@
-from fastapi import FastAPI, Request
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from httpx_aiohttp import AiohttpTransport
+import aiohttp
+import httpx
+import numpy as np
 import openai
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import tempfile
+import time
 
 # Load from .env
 load_dotenv()
 DEFAULT_API_KEY = os.getenv("OPENAI_API_KEY")
+SUPPORTED_MODELS = ["gpt-3.5-turbo"]
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Cosine similarity needed to reuse a cached answer for a paraphrase; unset disables
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0)
+# File the answer cache is saved to on shutdown and restored from on startup; unset disables
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH")
+
+# OpenAI clients, one per API key, reused across requests. Callers can send any
+# key, so the cache is an LRU; the .env key's client is never evicted.
+MAX_CLIENTS = 64
+_client_cache: OrderedDict[str, openai.AsyncOpenAI] = OrderedDict()
+_closing_clients: set[asyncio.Task] = set()
+# Requests currently using each client; evicted clients drain before closing
+_client_users: dict[openai.AsyncOpenAI, int] = {}
+_draining_clients: set[openai.AsyncOpenAI] = set()
+
+# aiohttp's default connector caps at 100 connections; size it for burst load
+def make_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=1000,
+        limit_per_host=500,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        # Same CA bundle httpx uses (certifi / SSL_CERT_FILE), not just system CAs
+        ssl=httpx.create_ssl_context(),
+    )
+    # trust_env so HTTPS_PROXY and friends still apply
+    return aiohttp.ClientSession(connector=connector, trust_env=True)
+
+def get_client(api_key: str) -> openai.AsyncOpenAI:
+    client = _client_cache.get(api_key)
+    if client is not None:
+        _client_cache.move_to_end(api_key)
+        return client
+
+    # aiohttp transport holds up far better than httpx under concurrent load
+    client = _client_cache[api_key] = openai.AsyncOpenAI(
+        api_key=api_key,
+        http_client=openai.DefaultAioHttpClient(
+            transport=AiohttpTransport(client=make_session),
+        ),
+    )
+    if len(_client_cache) > MAX_CLIENTS:
+        oldest = next(k for k in _client_cache if k != DEFAULT_API_KEY)
+        evicted = _client_cache.pop(oldest)
+        if _client_users.get(evicted):
+            _draining_clients.add(evicted)  # Closed by the last request using it
+        else:
+            close_in_background(evicted)
+    return client
+
+def close_in_background(client: openai.AsyncOpenAI) -> None:
+    task = asyncio.get_running_loop().create_task(client.close())
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+# Borrow the key's client for the duration of one request
+@asynccontextmanager
+async def use_client(api_key: str):
+    client = get_client(api_key)
+    _client_users[client] = _client_users.get(client, 0) + 1
+    try:
+        yield client
+    finally:
+        _client_users[client] -= 1
+        if not _client_users[client]:
+            del _client_users[client]
+            if client in _draining_clients:
+                _draining_clients.discard(client)
+                close_in_background(client)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ANSWER_CACHE_PATH:
+        load_answer_cache(ANSWER_CACHE_PATH)
+    yield
+    # Close pooled connections on shutdown
+    for client in [*_client_cache.values(), *_draining_clients]:
+        await client.close()
+    _client_cache.clear()
+    _draining_clients.clear()
+    await asyncio.gather(*_closing_clients)
+    if ANSWER_CACHE_PATH:
+        save_answer_cache(ANSWER_CACHE_PATH)
 
 # FastAPI setup
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS for frontend dev
 app.add_middleware(
@@ -21,11 +119,237 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger JSON bodies (event streams are left alone)
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# Single chat completion for one question
+async def create_answer(api_key: str, model: str, q: str) -> str:
+    async with use_client(api_key) as client:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": q}],
+        )
+    return response.choices[0].message.content.strip()
+
+# Approximate-match cache over normalized question embeddings, LRU-evicted with a TTL
+SEMANTIC_CACHE_MAX = 2_000
+
+class SemanticCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.keys: np.ndarray | None = None  # (max_size, dim), allocated on first add
+        self.values: list[str] = []
+        self.last_used = np.zeros(max_size, dtype=np.int64)
+        self.expires_at = np.zeros(max_size, dtype=np.float64)
+        self.clock = 0
+
+    def lookup(self, embedding: np.ndarray, threshold: float) -> str | None:
+        n = len(self.values)
+        if not n:
+            return None
+        sims = self.keys[:n] @ embedding
+        sims[self.expires_at[:n] < time.time()] = -np.inf
+        best = int(sims.argmax())
+        if sims[best] < threshold:
+            return None
+        self.clock += 1
+        self.last_used[best] = self.clock
+        return self.values[best]
+
+    def add(self, embedding: np.ndarray, answer: str) -> None:
+        if self.keys is None:
+            self.keys = np.zeros((self.max_size, embedding.shape[0]), dtype=np.float32)
+        now = time.time()
+        if len(self.values) < self.max_size:
+            i = len(self.values)
+            self.values.append(answer)
+        else:
+            # Reuse an expired row if there is one, else the least recently used
+            expired = np.flatnonzero(self.expires_at < now)
+            i = int(expired[0]) if expired.size else int(self.last_used.argmin())
+            self.values[i] = answer
+        self.keys[i] = embedding
+        self.expires_at[i] = now + self.ttl_seconds
+        self.clock += 1
+        self.last_used[i] = self.clock
+
+_semantic_caches: dict[str, SemanticCache] = {}
+
+async def embed(api_key: str, q: str) -> np.ndarray:
+    async with use_client(api_key) as client:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=q)
+    embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+# Answer from the semantic cache when enabled, otherwise ask OpenAI
+async def resolve_answer(api_key: str, model: str, q: str) -> str:
+    if not SEMANTIC_CACHE_THRESHOLD:
+        return await create_answer(api_key, model, q)
+
+    cache = _semantic_caches.get(model)
+    if cache is None:
+        cache = _semantic_caches[model] = SemanticCache(SEMANTIC_CACHE_MAX, CACHE_TTL_SECONDS)
+
+    try:
+        embedding = await embed(api_key, q)
+    except openai.OpenAIError:
+        # The cache is an optimization; a failed embedding shouldn't fail the question
+        return await create_answer(api_key, model, q)
+
+    answer = cache.lookup(embedding, SEMANTIC_CACHE_THRESHOLD)
+    if answer is None:
+        answer = await create_answer(api_key, model, q)
+        cache.add(embedding, answer)
+    return answer
+
+# Upstream calls in flight, so identical concurrent questions share one request
+MAX_INFLIGHT = 1024
+_inflight: dict[tuple[str, str], asyncio.Task[str]] = {}  # (api_key, cache_key) -> call
+
+# Exact-match LRU of answers with a TTL, keyed by model + normalized question
+CACHE_MAX = 10_000
+CACHE_TTL_SECONDS = 300
+_answer_cache: OrderedDict[str, tuple[str, float]] = OrderedDict()  # key -> (answer, expires_at)
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+def cache_key(model: str, q: str) -> str:
+    return hashlib.sha256(f"{model}|{q.strip().lower()}".encode()).hexdigest()
+
+def lookup_answer(ck: str) -> str | None:
+    entry = _answer_cache.get(ck)
+    if entry is not None and entry[1] < time.time():
+        del _answer_cache[ck]
+        _cache_stats["expirations"] += 1
+        entry = None
+    if entry is None:
+        _cache_stats["misses"] += 1
+        return None
+    _answer_cache.move_to_end(ck)
+    _cache_stats["hits"] += 1
+    return entry[0]
+
+def remember_answer(ck: str, answer: str) -> None:
+    _answer_cache[ck] = (answer, time.time() + CACHE_TTL_SECONDS)
+    _answer_cache.move_to_end(ck)
+    if len(_answer_cache) > CACHE_MAX:
+        _answer_cache.popitem(last=False)
+        _cache_stats["evictions"] += 1
+
+# Warm start across restarts; entries keep their original expiry
+def load_answer_cache(path: str) -> None:
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(entries, list):
+        return
+    now = time.time()
+    for entry in entries[-CACHE_MAX:]:
+        # Skip anything that isn't a [key, answer, expires_at] triple
+        if not (isinstance(entry, list) and len(entry) == 3):
+            continue
+        ck, answer, expires_at = entry
+        if (
+            isinstance(ck, str)
+            and isinstance(answer, str)
+            and isinstance(expires_at, (int, float))
+            and expires_at > now
+        ):
+            _answer_cache[ck] = (answer, expires_at)
+
+def save_answer_cache(path: str) -> None:
+    entries = [[ck, answer, expires_at] for ck, (answer, expires_at) in _answer_cache.items()]
+    # Unique temp file per process, so workers shutting down together don't collide
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False
+    ) as f:
+        json.dump(entries, f)
+    os.replace(f.name, path)
+
+async def get_answer(api_key: str, model: str, q: str) -> str:
+    ck = cache_key(model, q)
+    answer = lookup_answer(ck)
+    if answer is not None:
+        return answer
+
+    # Same normalization as the answer cache, so "Hello" and "hello " share a call
+    key = (api_key, ck)
+    task = _inflight.get(key)
+    if task is None:
+        if len(_inflight) >= MAX_INFLIGHT:
+            answer = await resolve_answer(api_key, model, q)
+            remember_answer(ck, answer)
+            return answer
+
+        # Own task, so cancelling whichever request started it doesn't cancel the rest
+        task = _inflight[key] = asyncio.create_task(resolve_answer(api_key, model, q))
+        task.add_done_callback(functools.partial(finish_inflight, key, ck))
+
+    # Shield so one caller disconnecting doesn't cancel the shared call
+    return await asyncio.shield(task)
+
+def finish_inflight(key: tuple[str, str], ck: str, task: asyncio.Task[str]) -> None:
+    del _inflight[key]
+    # Checking exception() also marks it retrieved when every caller has gone
+    if not task.cancelled() and task.exception() is None:
+        remember_answer(ck, task.result())
+
+# Server-Sent Events: one JSON payload per token, then [DONE]
+def sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+# Streaming only uses the exact-match cache: misses are neither coalesced with
+# identical in-flight questions nor checked against or added to the semantic cache.
+async def stream_answer(api_key: str, model: str, q: str):
+    ck = cache_key(model, q)
+    answer = lookup_answer(ck)
+    if answer is not None:
+        yield sse({"token": answer})
+        yield "data: [DONE]\n\n"
+        return
+
+    tokens = []
+    try:
+        async with use_client(api_key) as client:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": q}],
+                stream=True,
+            )
+            # Release the upstream connection even if the client disconnects mid-stream
+            async with stream:
+                async for chunk in stream:
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        tokens.append(token)
+                        yield sse({"token": token})
+    except openai.OpenAIError as e:
+        yield sse({"error": f"❌ OpenAI API error: {str(e)}"})
+        return
+    except Exception as e:
+        yield sse({"error": f"❌ Server error: {str(e)}"})
+        return
+
+    # An empty answer (e.g. a content-filter finish) would read back as a hit
+    answer = "".join(tokens).strip()
+    if answer:
+        remember_answer(ck, answer)
+    yield "data: [DONE]\n\n"
+
 # Pydantic request model
 class QueryRequest(BaseModel):
     q: str
     model: str = "gpt-3.5-turbo"
     api_key: str | None = None  # Optional, override default key
+    stream: bool = False  # Stream tokens as Server-Sent Events
+
+# Batch request model (answered via the OpenAI Batch API, within 24h)
+class BatchAskRequest(BaseModel):
+    items: list[str]
+    model: str = "gpt-3.5-turbo"
+    api_key: str | None = None
 
 # POST route
 @app.post("/ask")
@@ -38,19 +362,112 @@ async def ask(request: QueryRequest):
     if not request.q.strip():
         return {"error": "❌ Question cannot be empty."}
 
-    if request.model not in ["gpt-3.5-turbo"]:
+    if request.model not in SUPPORTED_MODELS:
         return {"error": f"❌ Unsupported model: {request.model}"}
 
-    try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=request.model,
-            messages=[{"role": "user", "content": request.q}],
+    if request.stream:
+        return StreamingResponse(
+            stream_answer(api_key, request.model, request.q),
+            media_type="text/event-stream",
         )
-        answer = response.choices[0].message.content.strip()
+
+    try:
+        answer = await get_answer(api_key, request.model, request.q)
         return {"answer": answer}
 
     except openai.OpenAIError as e:
         return {"error": f"❌ OpenAI API error: {str(e)}"}
     except Exception as e:
         return {"error": f"❌ Server error: {str(e)}"}
+
+# Answer cache counters, for tuning CACHE_MAX / CACHE_TTL_SECONDS
+@app.get("/cache-stats")
+async def cache_stats():
+    return {**_cache_stats, "size": len(_answer_cache)}
+
+# Submit many questions as one OpenAI batch (half price, separate rate limits)
+@app.post("/ask-batch")
+async def ask_batch(request: BatchAskRequest):
+    api_key = request.api_key or DEFAULT_API_KEY
+    if not api_key:
+        return {"error": "❌ Missing API key (none in .env or request)"}
+
+    if not request.items or not all(q.strip() for q in request.items):
+        return {"error": "❌ Questions cannot be empty."}
+
+    if request.model not in SUPPORTED_MODELS:
+        return {"error": f"❌ Unsupported model: {request.model}"}
+
+    # One JSONL line per question; custom_id keeps the original order
+    lines = "\n".join(
+        json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": request.model,
+                "messages": [{"role": "user", "content": q}],
+            },
+        })
+        for i, q in enumerate(request.items)
+    )
+
+    try:
+        async with use_client(api_key) as client:
+            batch_file = await client.files.create(
+                file=("ask-batch.jsonl", lines.encode()),
+                purpose="batch",
+            )
+            batch = await client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+            return {"batch_id": batch.id, "status": batch.status}
+
+    except openai.OpenAIError as e:
+        return {"error": f"❌ OpenAI API error: {str(e)}"}
+    except Exception as e:
+        return {"error": f"❌ Server error: {str(e)}"}
+
+# Poll a batch; answers are returned in submission order once completed.
+# The key override comes in a header so it stays out of URLs and access logs.
+@app.get("/ask-batch-result/{batch_id}")
+async def ask_batch_result(
+    batch_id: str,
+    api_key: str | None = Header(default=None, alias="X-OpenAI-Key"),
+):
+    api_key = api_key or DEFAULT_API_KEY
+    if not api_key:
+        return {"error": "❌ Missing API key (none in .env or request)"}
+
+    try:
+        async with use_client(api_key) as client:
+            batch = await client.batches.retrieve(batch_id)
+            if batch.status != "completed":
+                return {"batch_id": batch.id, "status": batch.status}
+
+            answers: dict[int, str] = {}
+            if batch.output_file_id:
+                content = await client.files.content(batch.output_file_id)
+                for line in content.text.splitlines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    response = result.get("response") or {}
+                    if response.get("status_code") != 200:
+                        continue  # Failed items come back as None
+                    body = response["body"]
+                    answers[int(result["custom_id"])] = body["choices"][0]["message"]["content"].strip()
+
+            total = batch.request_counts.total if batch.request_counts else len(answers)
+            return {
+                "batch_id": batch.id,
+                "status": batch.status,
+                "answers": [answers.get(i) for i in range(total)],
+            }
+
+    except openai.OpenAIError as e:
+        return {"error": f"❌ OpenAI API error: {str(e)}"}
+    except Exception as e:
+        return {"error": f"❌ Server error: {str(e)}"}